@@ -1,5 +1,5 @@
 from datetime import datetime, date
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, Date
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, Date, Index, text
 from sqlalchemy.orm import relationship
 from .session import Base
 
@@ -35,6 +35,20 @@ class GameSession(Base):
     # Relationships
     user = relationship("User", back_populates="game_sessions")
     rounds = relationship("GameRound", back_populates="game_session", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Partial index for the "active game" lookup done by every game endpoint
+        Index(
+            "ix_active_game", "user_id",
+            postgresql_where=text("is_completed = false"),
+            sqlite_where=text("is_completed = 0")
+        ),
+        # Covering index so the leaderboard is served by an index-only scan
+        Index(
+            "ix_leaderboard", is_completed, total_score.desc(),
+            postgresql_include=["user_id", "completed_at"]
+        ),
+    )
 
 
 class GameRound(Base):
@@ -64,3 +78,12 @@ class GameRound(Base):
     
     # Relationships
     game_session = relationship("GameSession", back_populates="rounds")
+    
+    __table_args__ = (
+        # Partial index for the "next incomplete round" lookup
+        Index(
+            "ix_round_current", "game_session_id", "round_number",
+            postgresql_where=text("completed_at IS NULL"),
+            sqlite_where=text("completed_at IS NULL")
+        ),
+    )
@@ -4,11 +4,16 @@ from ..config import get_settings
 
 settings = get_settings()
 
-# Create async engine
+# Create async engine with an explicitly sized connection pool
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=True,
-    future=True
+    echo=False,
+    future=True,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,  # Drop dead connections after a database restart
+    pool_recycle=3600
 )
 
 # Create async session factory
@@ -35,7 +40,20 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
+def _create_missing_indexes(sync_conn):
+    """Create indexes added after their tables already existed."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def init_db():
     """Initialize database tables."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+
+
+async def close_db():
+    """Close all pooled database connections."""
+    await engine.dispose()
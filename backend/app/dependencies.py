@@ -2,13 +2,15 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import get_settings
 from .database.session import get_db
 from .database.models import User
+from .services.immich import ImmichClient
+from .services.cache import AssetCache
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -71,3 +73,13 @@ async def get_current_user(
         raise credentials_exception
     
     return user
+
+
+def get_immich_client(request: Request) -> ImmichClient:
+    """Get the shared Immich client created at application startup."""
+    return request.app.state.immich_client
+
+
+def get_asset_cache(request: Request) -> AssetCache:
+    """Get the shared image cache created at application startup."""
+    return request.app.state.asset_cache
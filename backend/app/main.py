@@ -1,21 +1,44 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from fastapi.utils import is_body_allowed_for_status_code
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from contextlib import asynccontextmanager
+from redis.asyncio import Redis
 
-from .database.session import init_db
+from .database.session import init_db, close_db
 from .routers import auth, game
+from .services.immich import ImmichClient
+from .services.cache import AssetCache
+from .services import geo, scoring
 from .config import get_settings
 
-settings = get_settings()
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle events for the application."""
+    settings = get_settings()
+    
     # Startup: Initialize database
     await init_db()
+    
+    # Compile JIT kernels before the first request needs them
+    geo.warmup()
+    scoring.warmup()
+    
+    # Shared Immich client with a pooled connection for all requests
+    app.state.immich_client = ImmichClient(settings.IMMICH_API_URL, settings.IMMICH_API_KEY)
+    
+    # Cache for proxied Immich images
+    app.state.redis = Redis.from_url(settings.REDIS_URL, socket_connect_timeout=2)
+    app.state.asset_cache = AssetCache(app.state.redis)
     yield
-    # Shutdown: Clean up resources if needed
+    # Shutdown: Close pooled connections
+    await app.state.immich_client.close()
+    await app.state.redis.aclose()
+    await close_db()
 
 
 # Create FastAPI application
@@ -23,9 +46,27 @@ app = FastAPI(
     title="Immich Guesser",
     description="Geoguesser-style game using photos from your Immich instance",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
+
+# Error responses are serialized with orjson too (FastAPI's built-in handlers use JSONResponse)
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request: Request, exc: StarletteHTTPException):
+    """Return HTTP errors as ORJSONResponse."""
+    headers = getattr(exc, "headers", None)
+    if not is_body_allowed_for_status_code(exc.status_code):
+        return Response(status_code=exc.status_code, headers=headers)
+    return ORJSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=headers)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """Return request validation errors as ORJSONResponse."""
+    return ORJSONResponse({"detail": jsonable_encoder(exc.errors())}, status_code=422)
+
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
 from datetime import datetime, date
 
@@ -44,8 +44,7 @@ class GameSessionResponse(BaseModel):
     start_date: Optional[date] = None
     end_date: Optional[date] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, defer_build=True)
 
 
 class RoundResponse(BaseModel):
@@ -59,8 +58,7 @@ class RoundResponse(BaseModel):
     guess_latitude: Optional[float] = None
     guess_longitude: Optional[float] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, defer_build=True)
 
 
 class LeaderboardEntry(BaseModel):
@@ -69,8 +67,7 @@ class LeaderboardEntry(BaseModel):
     total_score: int
     completed_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, defer_build=True)
 
 
 class LeaderboardResponse(BaseModel):
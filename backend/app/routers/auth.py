@@ -7,10 +7,9 @@ from ..database.session import get_db
 from ..database.models import User
 from ..models.user import UserCreate, UserLogin, UserResponse, Token
 from ..dependencies import get_password_hash, verify_password, create_access_token, get_current_user
-from ..config import get_settings
+from ..config import Settings, get_settings
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
-settings = get_settings()
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -49,7 +48,11 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
 
 
 @router.post("/login", response_model=Token)
-async def login(user_data: UserLogin, db: AsyncSession = Depends(get_db)):
+async def login(
+    user_data: UserLogin,
+    db: AsyncSession = Depends(get_db),
+    settings: Settings = Depends(get_settings)
+):
     """Login and get access token."""
     
     # Find user
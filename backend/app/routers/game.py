@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import Response
+import asyncio
+from functools import partial
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, status
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, insert, desc, func
+from sqlalchemy.orm import contains_eager
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from ..database.session import get_db
 from ..database.models import User, GameSession, GameRound
@@ -12,33 +16,81 @@ from ..models.game import (
     GuessRequest, GuessResponse, LeaderboardResponse, LeaderboardEntry,
     RoundResponse
 )
-from ..dependencies import get_current_user
-from ..services.immich import ImmichClient
+from ..dependencies import get_current_user, get_immich_client, get_asset_cache
+from ..services.immich import ImmichClient, ASSET_QUALITIES, STREAM_CHUNK_SIZE
+from ..services.cache import AssetCache, CACHED_QUALITIES
 from ..services.scoring import haversine_distance, calculate_score
-from ..config import get_settings
+from ..config import Settings, get_settings
 
 router = APIRouter(prefix="/game", tags=["Game"])
-settings = get_settings()
 
-# Initialize Immich client
-immich_client = ImmichClient(settings.IMMICH_API_URL, settings.IMMICH_API_KEY)
+
+def _active_game_query(user_id: int):
+    """Query for the user's active (incomplete) game."""
+    return select(GameSession).where(
+        GameSession.user_id == user_id,
+        GameSession.is_completed == False
+    ).order_by(desc(GameSession.started_at)).limit(1)
+
+
+def _current_game_query(user_id: int):
+    """Query for the active game, or the most recently completed one if none is active."""
+    return select(GameSession).where(
+        GameSession.user_id == user_id
+    ).order_by(
+        GameSession.is_completed,
+        desc(func.coalesce(GameSession.completed_at, GameSession.started_at))
+    ).limit(1)
+
+
+def _current_round_query(user_id: int):
+    """Query for the next incomplete round of the active game, with its game loaded."""
+    return select(GameRound).join(GameRound.game_session).where(
+        GameSession.user_id == user_id,
+        GameSession.is_completed == False,
+        GameRound.completed_at == None
+    ).options(
+        contains_eager(GameRound.game_session)
+    ).order_by(desc(GameSession.started_at), GameRound.round_number).limit(1)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def _prefetch_previews(immich_client: ImmichClient, asset_cache: AssetCache, asset_ids: List[str]):
+    """Download all round previews of a new game into the cache concurrently."""
+    # Failed downloads are skipped; the round will fetch them on demand
+    await asyncio.gather(
+        *(
+            asset_cache.fetch(asset_id, "preview", partial(immich_client.get_asset, asset_id, "preview"))
+            for asset_id in asset_ids
+        ),
+        return_exceptions=True
+    )
 
 
 @router.post("/start", response_model=GameSessionResponse, status_code=status.HTTP_201_CREATED)
 async def start_game(
     game_data: GameSessionCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    immich_client: ImmichClient = Depends(get_immich_client),
+    asset_cache: AssetCache = Depends(get_asset_cache),
+    settings: Settings = Depends(get_settings)
 ):
     """Start a new game session with optional date range filter."""
     
     # Check if user has an incomplete game
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
+    result = await db.execute(_active_game_query(current_user.id))
     existing_game = result.scalar_one_or_none()
     
     if existing_game:
@@ -57,33 +109,40 @@ async def start_game(
     except HTTPException as e:
         raise e
     
-    # Create new game session
-    new_game = GameSession(
-        user_id=current_user.id,
-        total_score=0,
-        rounds_completed=0,
-        is_completed=False,
-        start_date=game_data.start_date,
-        end_date=game_data.end_date
+    # Create new game session, getting generated columns back via RETURNING
+    result = await db.execute(
+        insert(GameSession).values(
+            user_id=current_user.id,
+            total_score=0,
+            rounds_completed=0,
+            is_completed=False,
+            start_date=game_data.start_date,
+            end_date=game_data.end_date
+        ).returning(GameSession)
     )
-    db.add(new_game)
-    await db.flush()
-    
-    # Create rounds for each photo
-    for i, photo in enumerate(photos, 1):
-        round_data = GameRound(
-            game_session_id=new_game.id,
-            round_number=i,
-            photo_id=photo["id"],
-            photo_url=photo["thumbnailUrl"],
-            immich_url=photo.get("immichUrl"),
-            actual_latitude=photo["latitude"],
-            actual_longitude=photo["longitude"]
-        )
-        db.add(round_data)
+    new_game = result.scalar_one()
+    
+    # Create rounds for each photo in a single executemany
+    rounds = [
+        {
+            "game_session_id": new_game.id,
+            "round_number": i,
+            "photo_id": photo["id"],
+            "photo_url": photo["thumbnailUrl"],
+            "immich_url": photo.get("immichUrl"),
+            "actual_latitude": photo["latitude"],
+            "actual_longitude": photo["longitude"]
+        }
+        for i, photo in enumerate(photos, 1)
+    ]
+    await db.execute(insert(GameRound), rounds)
     
     await db.commit()
-    await db.refresh(new_game)
+    
+    # Warm the cache so every round's photo loads without waiting on Immich
+    background_tasks.add_task(
+        _prefetch_previews, immich_client, asset_cache, [photo["id"] for photo in photos]
+    )
     
     return new_game
 
@@ -95,24 +154,10 @@ async def get_current_game(
 ):
     """Get the current game session (active or just completed)."""
     
-    # First try to get active game
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
+    # Active game first, otherwise the most recently completed one
+    result = await db.execute(_current_game_query(current_user.id))
     game = result.scalar_one_or_none()
     
-    # If no active game, try to get the most recently completed one
-    if not game:
-        result = await db.execute(
-            select(GameSession).where(
-                GameSession.user_id == current_user.id
-            ).order_by(desc(GameSession.completed_at)).limit(1)
-        )
-        game = result.scalar_one_or_none()
-    
     if not game:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -129,38 +174,24 @@ async def get_current_photo(
 ):
     """Get the current photo to guess (without GPS coordinates)."""
     
-    # Get current game
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
-    game = result.scalar_one_or_none()
-    
-    if not game:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No active game found. Start a new game."
-        )
-    
-    # Get current round (next incomplete round)
-    result = await db.execute(
-        select(GameRound).where(
-            GameRound.game_session_id == game.id,
-            GameRound.completed_at == None
-        ).order_by(GameRound.round_number).limit(1)
-    )
+    # Get current round (next incomplete round of the active game)
+    result = await db.execute(_current_round_query(current_user.id))
     current_round = result.scalar_one_or_none()
     
     if not current_round:
+        result = await db.execute(_active_game_query(current_user.id))
+        if not result.scalar_one_or_none():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No active game found. Start a new game."
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="All rounds completed. Game is finished."
         )
     
     # Return photo WITHOUT GPS coordinates
-    return PhotoResponse(
+    return PhotoResponse.model_construct(
         photo_id=current_round.photo_id,
         photo_url=f"/game/photo/{current_round.photo_id}/preview",
         round_number=current_round.round_number
@@ -171,40 +202,29 @@ async def get_current_photo(
 async def submit_guess(
     guess: GuessRequest,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    settings: Settings = Depends(get_settings)
 ):
     """Submit a guess for the current round."""
     
-    # Get current game
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
-    game = result.scalar_one_or_none()
-    
-    if not game:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No active game found."
-        )
-    
-    # Get current round
-    result = await db.execute(
-        select(GameRound).where(
-            GameRound.game_session_id == game.id,
-            GameRound.completed_at == None
-        ).order_by(GameRound.round_number).limit(1)
-    )
+    # Get current round together with its game
+    result = await db.execute(_current_round_query(current_user.id))
     current_round = result.scalar_one_or_none()
     
     if not current_round:
+        result = await db.execute(_active_game_query(current_user.id))
+        if not result.scalar_one_or_none():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No active game found."
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No active round found."
         )
     
+    game = current_round.game_session
+    
     # Calculate distance and score
     distance = haversine_distance(
         guess.latitude, guess.longitude,
@@ -231,7 +251,7 @@ async def submit_guess(
     
     await db.commit()
     
-    return GuessResponse(
+    return GuessResponse.model_construct(
         distance_km=distance,
         score=score,
         actual_latitude=current_round.actual_latitude,
@@ -249,38 +269,25 @@ async def get_game_rounds(
 ):
     """Get all rounds for the current game."""
     
-    # Get current game (active or most recently completed)
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
-    game = result.scalar_one_or_none()
-    
-    # If no active game, get most recently completed
-    if not game:
-        result = await db.execute(
-            select(GameSession).where(
-                GameSession.user_id == current_user.id
-            ).order_by(desc(GameSession.completed_at)).limit(1)
-        )
-        game = result.scalar_one_or_none()
-    
-    if not game:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="No active game found."
-        )
-    
-    # Get all rounds
+    # Get all rounds of the current game (active or most recently completed)
+    current_game_id = _current_game_query(current_user.id).with_only_columns(
+        GameSession.id
+    ).scalar_subquery()
     result = await db.execute(
         select(GameRound).where(
-            GameRound.game_session_id == game.id
+            GameRound.game_session_id == current_game_id
         ).order_by(GameRound.round_number)
     )
     rounds = result.scalars().all()
     
+    if not rounds:
+        result = await db.execute(_current_game_query(current_user.id))
+        if not result.scalar_one_or_none():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No active game found."
+            )
+    
     return rounds
 
 
@@ -291,20 +298,23 @@ async def get_leaderboard(
 ):
     """Get the top scores leaderboard."""
     
-    # Get top completed games
+    # Get top completed games, reading only the columns we need
     result = await db.execute(
-        select(GameSession, User).join(User).where(
+        select(User.username, GameSession.total_score, GameSession.completed_at).join(
+            User, GameSession.user_id == User.id
+        ).where(
             GameSession.is_completed == True
         ).order_by(desc(GameSession.total_score)).limit(limit)
     )
     
-    entries = []
-    for game, user in result:
-        entries.append(LeaderboardEntry(
-            username=user.username,
-            total_score=game.total_score,
-            completed_at=game.completed_at
-        ))
+    entries = [
+        LeaderboardEntry.model_construct(
+            username=username,
+            total_score=total_score,
+            completed_at=completed_at
+        )
+        for username, total_score, completed_at in result.all()
+    ]
     
     return LeaderboardResponse(entries=entries)
 
@@ -316,12 +326,7 @@ async def delete_current_game(
 ):
     """Delete the current active game."""
     
-    result = await db.execute(
-        select(GameSession).where(
-            GameSession.user_id == current_user.id,
-            GameSession.is_completed == False
-        ).order_by(desc(GameSession.started_at)).limit(1)
-    )
+    result = await db.execute(_active_game_query(current_user.id))
     game = result.scalar_one_or_none()
     
     if not game:
@@ -340,16 +345,46 @@ async def delete_current_game(
 async def get_photo_proxy(
     asset_id: str,
     quality: str,
-    current_user: User = Depends(get_current_user)
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    immich_client: ImmichClient = Depends(get_immich_client),
+    asset_cache: AssetCache = Depends(get_asset_cache)
 ):
     """Proxy photo requests to Immich with API key."""
-    try:
-        if quality == "preview":
-            image_bytes = await immich_client.get_asset_preview(asset_id)
-        elif quality == "original":
-            image_bytes = await immich_client.get_asset_original(asset_id)
-        else:
-            image_bytes = await immich_client.get_asset_thumbnail(asset_id)
-        return Response(content=image_bytes, media_type="image/jpeg")
-    except HTTPException as e:
-        raise e
+    if quality not in ASSET_QUALITIES:
+        quality = "thumbnail"
+    
+    # Asset images never change, so browsers may reuse them without revalidating;
+    # private since they come from a personal library behind authentication
+    etag = f'"{quality}-{asset_id}"'
+    headers = {
+        "Cache-Control": "private, max-age=86400, immutable",
+        "ETag": etag
+    }
+    
+    # The browser already has this image: skip the cache and Immich entirely
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    if quality in CACHED_QUALITIES:
+        cached = await asset_cache.get(asset_id, quality)
+        if cached is not None:
+            return Response(content=cached.data, media_type=cached.media_type, headers=headers)
+    
+    upstream = await immich_client.open_asset_stream(asset_id, quality)
+    
+    # Pass through what Immich serves: thumbnails are often WebP, originals any format
+    media_type = upstream.headers.get("content-type", "image/jpeg")
+    if "content-length" in upstream.headers and "content-encoding" not in upstream.headers:
+        headers["Content-Length"] = upstream.headers["content-length"]
+    
+    body = upstream.aiter_bytes(STREAM_CHUNK_SIZE)
+    if quality in CACHED_QUALITIES:
+        body = asset_cache.tee(asset_id, quality, media_type, body)
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers=headers,
+        background=BackgroundTask(upstream.aclose)
+    )
@@ -0,0 +1,187 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+# Image qualities small enough to keep in the cache (originals are only streamed)
+CACHED_QUALITIES = {"thumbnail", "preview"}
+
+# In-process cache in front of Redis: total image bytes kept per quality in each worker
+LOCAL_CACHE_SIZES = {"thumbnail": 32 * 1024 * 1024, "preview": 96 * 1024 * 1024}
+LOCAL_CACHE_TTL = 600
+
+# How long to wait for another request's download of the same image before fetching it again
+INFLIGHT_WAIT_TIMEOUT = 30.0
+
+
+class CachedAsset(NamedTuple):
+    """Cached image bytes with the media type Immich served them with."""
+    data: bytes
+    media_type: str
+
+
+def _asset_size(asset: CachedAsset) -> int:
+    """Size of a cached image as counted against the local cache limits."""
+    return len(asset.data)
+
+
+class AssetCache:
+    """Cache for image bytes proxied from Immich: an in-process TTL cache in front of Redis."""
+    
+    def __init__(self, redis: Redis, ttl: int = 86400, max_size: int = 5 * 1024 * 1024):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local: Dict[str, TTLCache] = {
+            quality: TTLCache(maxsize=size, ttl=LOCAL_CACHE_TTL, getsizeof=_asset_size)
+            for quality, size in LOCAL_CACHE_SIZES.items()
+        }
+        # Downloads in progress, so concurrent requests for one image share a single fetch
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    @staticmethod
+    def _key(asset_id: str, quality: str) -> str:
+        return f"immich:{quality}:{asset_id}"
+    
+    def _remember(self, quality: str, key: str, asset: CachedAsset) -> None:
+        """Keep an image in the local cache, unless it alone exceeds the cache's byte limit."""
+        local = self._local[quality]
+        if _asset_size(asset) <= local.maxsize:
+            local[key] = asset
+    
+    async def get(self, asset_id: str, quality: str) -> Optional[CachedAsset]:
+        """
+        Get a cached image.
+        
+        Args:
+            asset_id: The asset ID
+            quality: Image quality
+        
+        If the image is being downloaded by another request, waits for that
+        download instead of reporting a miss.
+        
+        Returns:
+            Cached image, or None on a miss or if Redis is unavailable
+        """
+        key = self._key(asset_id, quality)
+        local = self._local[quality]
+        cached = local.get(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            data, media_type = await self.redis.hmget(key, "data", "type")
+        except RedisError:
+            data = media_type = None
+        if data is not None and media_type is not None:
+            cached = CachedAsset(data, media_type.decode())
+            self._remember(quality, key, cached)
+            return cached
+        
+        pending = self._inflight.get(key)
+        if pending is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending), INFLIGHT_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            # The download was abandoned without finishing; let the next request retry
+            if self._inflight.get(key) is pending:
+                del self._inflight[key]
+            return None
+    
+    async def set(self, asset_id: str, quality: str, data: bytes, media_type: str) -> None:
+        """Store an image; Redis failures are ignored since the cache is optional."""
+        if len(data) > self.max_size:
+            return
+        key = self._key(asset_id, quality)
+        self._remember(quality, key, CachedAsset(data, media_type))
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping={"data": data, "type": media_type})
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except RedisError:
+            pass
+    
+    def _claim(self, key: str) -> Optional[asyncio.Future]:
+        """Mark an image as being downloaded; None if another request already is."""
+        if key in self._inflight:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+    
+    def _release(self, key: str, future: asyncio.Future, result: Optional[CachedAsset]) -> None:
+        """Finish a download, handing the image (or None on failure) to anyone waiting."""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.done():
+            future.set_result(result)
+    
+    async def fetch(
+        self,
+        asset_id: str,
+        quality: str,
+        download: Callable[[], Awaitable[Tuple[bytes, str]]]
+    ) -> Optional[CachedAsset]:
+        """
+        Get an image from the cache, downloading and storing it on a miss.
+        
+        Args:
+            asset_id: The asset ID
+            quality: Image quality
+            download: Coroutine factory returning the image bytes and media type
+        
+        Returns:
+            The image, or None if another request's download of it failed
+        """
+        cached = await self.get(asset_id, quality)
+        if cached is not None:
+            return cached
+        
+        key = self._key(asset_id, quality)
+        future = self._claim(key)
+        if future is None:
+            return await self.get(asset_id, quality)
+        
+        result = None
+        try:
+            data, media_type = await download()
+            result = CachedAsset(data, media_type)
+            await self.set(asset_id, quality, data, media_type)
+        finally:
+            self._release(key, future, result)
+        return result
+    
+    async def tee(
+        self,
+        asset_id: str,
+        quality: str,
+        media_type: str,
+        chunks: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """
+        Pass image chunks through while collecting them into the cache.
+        
+        The image is only stored once the stream has been fully consumed.
+        """
+        key = self._key(asset_id, quality)
+        future = self._claim(key)
+        result = None
+        try:
+            buffer: Optional[bytearray] = bytearray()
+            async for chunk in chunks:
+                if buffer is not None:
+                    buffer += chunk
+                    if len(buffer) > self.max_size:
+                        buffer = None  # Too large to cache, keep streaming only
+                yield chunk
+            
+            if buffer is not None:
+                result = CachedAsset(bytes(buffer), media_type)
+                await self.set(asset_id, quality, result.data, media_type)
+        finally:
+            if future is not None:
+                self._release(key, future, result)
@@ -0,0 +1,84 @@
+import math
+import numpy as np
+from numba import njit
+
+
+EARTH_RADIUS_KM = 6371.0
+
+# Pairs whose flat-earth distance exceeds this multiple of the threshold are rejected
+# without running the exact haversine formula
+PREFILTER_FACTOR = 2.0
+
+
+@njit(fastmath=True, cache=True)
+def any_within_km(
+    sel_lat: np.ndarray,
+    sel_lon: np.ndarray,
+    cand_lat: float,
+    cand_lon: float,
+    threshold_km: float
+) -> bool:
+    """
+    Check whether a candidate point is closer than threshold_km to any selected point.
+    
+    Args:
+        sel_lat, sel_lon: Coordinates of the selected points (radians)
+        cand_lat, cand_lon: Coordinates of the candidate point (radians)
+        threshold_km: Distance threshold in kilometers
+    
+    Returns:
+        True as soon as one selected point is within the threshold
+    """
+    cos_cand_lat = math.cos(cand_lat)
+    # Equirectangular pre-filter bound, in squared radians to avoid a sqrt
+    prefilter_sq = (PREFILTER_FACTOR * threshold_km / EARTH_RADIUS_KM) ** 2
+    for i in range(sel_lat.shape[0]):
+        dlat = sel_lat[i] - cand_lat
+        dlon = sel_lon[i] - cand_lon
+        # Wrap across the antimeridian so nearby points stay nearby
+        if dlon > math.pi:
+            dlon -= 2 * math.pi
+        elif dlon < -math.pi:
+            dlon += 2 * math.pi
+        
+        # Cheap flat-earth estimate rejects the vast majority of pairs
+        x = dlon * cos_cand_lat
+        if x * x + dlat * dlat > prefilter_sq:
+            continue
+        
+        # Exact haversine only for pairs that may be within the threshold
+        a = math.sin(dlat / 2) ** 2 + math.cos(sel_lat[i]) * cos_cand_lat * math.sin(dlon / 2) ** 2
+        if 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)) < threshold_km:
+            return True
+    return False
+
+
+class ProximityIndex:
+    """
+    Set of selected points that answers "is this candidate too close to any of them?".
+    
+    Backed by a linear scan with the compiled any_within_km kernel, which stays in the
+    microseconds for the few thousand points a game could ever select.
+    """
+    
+    def __init__(self, threshold_km: float):
+        self.threshold_km = threshold_km
+        self.lat_rad = np.empty(0)
+        self.lon_rad = np.empty(0)
+    
+    def __len__(self) -> int:
+        return self.lat_rad.shape[0]
+    
+    def add(self, lat_rad: float, lon_rad: float):
+        """Add a selected point (radians)."""
+        self.lat_rad = np.append(self.lat_rad, lat_rad)
+        self.lon_rad = np.append(self.lon_rad, lon_rad)
+    
+    def is_near(self, lat_rad: float, lon_rad: float) -> bool:
+        """Check whether a candidate (radians) is within the threshold of any selected point."""
+        return any_within_km(self.lat_rad, self.lon_rad, lat_rad, lon_rad, self.threshold_km)
+
+
+def warmup():
+    """Compile the JIT kernels so the first game start does not pay for it."""
+    any_within_km(np.zeros(1), np.zeros(1), 0.0, 0.0, 1.0)
@@ -1,36 +1,295 @@
-from typing import List, Optional, Dict, Any
-from datetime import datetime, date
+from typing import List, NamedTuple, Optional, Dict, Any, Tuple
+from datetime import date
+import asyncio
+import logging
+import time
 import httpx
+import numpy as np
 from fastapi import HTTPException, status
 import random
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # Fall back to the stdlib parser, which also accepts bytes
+    from json import loads as json_loads
+
+from .geo import ProximityIndex
+
+logger = logging.getLogger(__name__)
+
+
+# Minimum distance between photos selected for the same game
+MIN_PHOTO_DISTANCE_KM = 1.0
+
+# Number of search pages requested in the first batch; most libraries need no more
+INITIAL_PAGE_BATCH = 3
+# Number of search pages requested at the same time when more are needed
+PAGE_CONCURRENCY = 5
+# Stop scanning once there are this many GPS photos per requested photo...
+CANDIDATE_OVERSAMPLE = 20
+# ...taken on at least this many distinct days per requested photo
+DAY_OVERSAMPLE = 3
+# Search requests fail fast instead of holding a game start for the full client timeout
+SEARCH_TIMEOUT = 10.0
+# Pause before the single retry of a search request that could not reach Immich
+SEARCH_RETRY_DELAY = 0.5
+# Seconds a scanned candidate pool is reused for new games with the same date range
+CANDIDATE_POOL_TTL = 300.0
+
+# Asset image endpoints by quality: (path under /assets/{id}/, query params, description)
+PREVIEW_PARAMS = {"size": "preview"}
+ASSET_QUALITIES = {
+    "thumbnail": ("thumbnail", None, "thumbnail"),
+    "preview": ("thumbnail", PREVIEW_PARAMS, "preview image"),
+    "original": ("original", None, "original image"),
+}
+# Chunk size used when streaming images to the browser
+STREAM_CHUNK_SIZE = 64 * 1024
+# Maximum number of image downloads running at once for bulk prefetches
+MAX_CONCURRENT_DOWNLOADS = 16
+
+
+class _Candidate(NamedTuple):
+    """GPS-tagged asset considered for a game; photo dicts are only built for selected ones."""
+    asset_id: str
+    latitude: float
+    longitude: float
+    date_taken: str
+    # Only the EXIF fields shown for a photo, so pools do not keep whole EXIF dicts alive
+    city: Optional[str]
+    state: Optional[str]
+    country: Optional[str]
+
+
+class _CandidatePool(NamedTuple):
+    """Candidates scanned for one date range, shared by games started shortly after."""
+    fetched_at: float
+    count: int
+    candidates: List[_Candidate]
+
+
+def create_http_client(api_url: str, api_key: str) -> httpx.AsyncClient:
+    """
+    Create the pooled HTTP client used for all Immich requests.
+    
+    Base URL and authentication headers are bound once, so requests only pass a relative path.
+    """
+    return httpx.AsyncClient(
+        base_url=api_url.rstrip('/'),
+        headers={
+            "x-api-key": api_key,
+            "Accept": "application/json"
+        },
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        # Keep idle connections (and their HTTP/2 sessions) open between games
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0),
+        http2=True
+    )
+
 
 class ImmichClient:
     """Client for interacting with Immich API."""
     
-    def __init__(self, api_url: str, api_key: str):
+    def __init__(self, api_url: str, api_key: str, client: Optional[httpx.AsyncClient] = None):
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
-        self.headers = {
-            "x-api-key": api_key,
-            "Accept": "application/json"
+        # Immich web UI base for links to photos, computed once instead of per photo
+        self._ui_base = self.api_url.replace('/api', '')
+        # One long-lived pooled client, so connections and TLS sessions are reused
+        self._client = client or create_http_client(self.api_url, api_key)
+        self._download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        # Unknown until the first search; older Immich versions lack /search/random
+        self._random_search_supported: Optional[bool] = None
+        # Candidate pools by (start_date, end_date), refreshed after CANDIDATE_POOL_TTL
+        self._candidate_pools: Dict[Tuple[Optional[date], Optional[date]], _CandidatePool] = {}
+        # Scans in progress by the same key, so concurrent game starts share one scan
+        self._pool_scans: Dict[Tuple[Optional[date], Optional[date]], asyncio.Future] = {}
+    
+    async def close(self):
+        """Close the pooled HTTP connections."""
+        await self._client.aclose()
+    
+    async def __aenter__(self) -> "ImmichClient":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def _post_search(self, path: str, params: Dict[str, Any]) -> httpx.Response:
+        """
+        POST a search request, retrying once after a short pause if Immich cannot be reached.
+        
+        Error statuses are not retried; those are returned for the caller to handle.
+        """
+        try:
+            return await self._client.post(path, json=params, timeout=SEARCH_TIMEOUT)
+        except httpx.RequestError as e:
+            logger.warning("Immich search request to %s failed, retrying: %r", path, e)
+            await asyncio.sleep(SEARCH_RETRY_DELAY)
+            return await self._client.post(path, json=params, timeout=SEARCH_TIMEOUT)
+    
+    async def _search_assets(self, params: Dict[str, Any], page: int) -> List[Dict[str, Any]]:
+        """
+        Fetch one batch of assets matching the search filters.
+        
+        Uses Immich's random search so games draw from the whole library; falls back to
+        paging through metadata search on Immich versions without /search/random.
+        Neither endpoint can filter on GPS presence, so that stays client-side.
+        """
+        if self._random_search_supported is not False:
+            response = await self._post_search("/search/random", params)
+            if response.status_code in (status.HTTP_404_NOT_FOUND, status.HTTP_405_METHOD_NOT_ALLOWED):
+                self._random_search_supported = False
+            else:
+                response.raise_for_status()
+                self._random_search_supported = True
+                return json_loads(response.content)
+        
+        response = await self._post_search("/search/metadata", {**params, "page": page})
+        response.raise_for_status()
+        result = json_loads(response.content)
+        return result.get("assets", {}).get("items", []) if isinstance(result.get("assets"), dict) else result.get("assets", [])
+    
+    def _photo_from_candidate(self, candidate: "_Candidate") -> Dict[str, Any]:
+        """Build the photo dictionary for a selected candidate."""
+        asset_id = candidate.asset_id
+        return {
+            "id": asset_id,
+            "thumbnailUrl": f"/game/photo/{asset_id}/preview",
+            "originalUrl": f"{self.api_url}/assets/{asset_id}/original",
+            "immichUrl": f"{self._ui_base}/photos/{asset_id}",
+            "latitude": candidate.latitude,
+            "longitude": candidate.longitude,
+            "city": candidate.city,
+            "state": candidate.state,
+            "country": candidate.country,
+            "dateTaken": candidate.date_taken,
+        }
+    
+    async def _get_candidates(
+        self,
+        count: int,
+        start_date: Optional[date],
+        end_date: Optional[date]
+    ) -> List[_Candidate]:
+        """
+        Get GPS-tagged candidates for a date range, reusing a recently scanned pool.
+        
+        Consecutive games draw from one pool instead of each paying for a library scan;
+        the pool is rescanned once it is older than CANDIDATE_POOL_TTL.
+        """
+        key = (start_date, end_date)
+        pool = self._candidate_pools.get(key)
+        if pool is not None and pool.count >= count and time.monotonic() - pool.fetched_at < CANDIDATE_POOL_TTL:
+            return pool.candidates
+        
+        # Starts with the same date range wait for one scan; other ranges scan concurrently.
+        # There is no await between the lookup and the insert, so no lock is needed.
+        scan = self._pool_scans.get(key)
+        if scan is None:
+            scan = asyncio.ensure_future(self._scan_pool(key, count))
+            self._pool_scans[key] = scan
+            scan.add_done_callback(lambda done: self._finish_pool_scan(key, done))
+        # Shielded so one cancelled game start does not abort the scan for the others
+        return await asyncio.shield(scan)
+    
+    def _finish_pool_scan(self, key: Tuple[Optional[date], Optional[date]], scan: asyncio.Future):
+        """Forget a finished scan so the next miss for its key starts a new one."""
+        if self._pool_scans.get(key) is scan:
+            del self._pool_scans[key]
+    
+    async def _scan_pool(self, key: Tuple[Optional[date], Optional[date]], count: int) -> List[_Candidate]:
+        """Scan Immich for one date range and store the result as its candidate pool."""
+        start_date, end_date = key
+        base_params = {
+            "isNotInAlbum": False,
+            "withExif": True,
+            "size": 100
+        }
+        
+        # Add date filters if provided
+        if start_date:
+            base_params["takenAfter"] = start_date.isoformat() + "T00:00:00.000Z"
+        if end_date:
+            base_params["takenBefore"] = end_date.isoformat() + "T23:59:59.999Z"
+        
+        candidates = await self._collect_candidates(count, base_params)
+        
+        # Drop expired pools so arbitrary date ranges do not accumulate
+        now = time.monotonic()
+        self._candidate_pools = {
+            pool_key: cached for pool_key, cached in self._candidate_pools.items()
+            if now - cached.fetched_at < CANDIDATE_POOL_TTL
         }
+        self._candidate_pools[key] = _CandidatePool(now, count, candidates)
+        return candidates
     
-    def _calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        """Calculate distance between two coordinates in kilometers using haversine formula."""
-        from math import radians, sin, cos, sqrt, atan2
+    async def _collect_candidates(self, count: int, base_params: Dict[str, Any]) -> List[_Candidate]:
+        """
+        Scan Immich search results for photos with GPS coordinates.
         
-        R = 6371  # Earth radius in km
+        Pages are fetched concurrently in batches, stopping once there are enough
+        candidates spread over enough days for a game of `count` photos.
+        """
+        # Collect all photos with GPS from multiple pages
+        all_photos = []
+        max_pages = 20  # Scan up to 20 pages
         
-        lat1_rad = radians(lat1)
-        lat2_rad = radians(lat2)
-        delta_lat = radians(lat2 - lat1)
-        delta_lon = radians(lon2 - lon1)
+        days_seen = set()
+        seen_ids = set()
         
-        a = sin(delta_lat / 2) ** 2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lon / 2) ** 2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+        # Fetch pages concurrently in batches, escalating only while we need more photos
+        next_page = 1
+        batch_size = INITIAL_PAGE_BATCH
+        while next_page <= max_pages:
+            pages = range(next_page, min(next_page + batch_size, max_pages + 1))
+            next_page += len(pages)
+            batch_size = PAGE_CONCURRENCY
+            batches = await asyncio.gather(
+                *(self._search_assets(base_params, page) for page in pages),
+                return_exceptions=True
+            )
+            
+            last_page_reached = False
+            for assets in batches:
+                if isinstance(assets, Exception):
+                    raise assets
+                
+                new_assets = 0
+                for asset in assets:
+                    # Random samples may repeat assets we already have
+                    asset_id = asset.get("id")
+                    if asset_id in seen_ids:
+                        continue
+                    seen_ids.add(asset_id)
+                    new_assets += 1
+                    
+                    # Filter assets that have GPS coordinates
+                    exif_info = asset.get("exifInfo")
+                    if not exif_info:
+                        continue
+                    lat = exif_info.get("latitude")
+                    lon = exif_info.get("longitude")
+                    date_taken_str = exif_info.get("dateTimeOriginal")
+                    
+                    # Check if coordinates exist and are not None/0
+                    if lat and lon and date_taken_str:
+                        all_photos.append(_Candidate(
+                            asset_id, lat, lon, date_taken_str,
+                            exif_info.get("city"), exif_info.get("state"), exif_info.get("country")
+                        ))
+                        days_seen.add(date_taken_str[:10])
+                
+                if not new_assets:
+                    last_page_reached = True  # No more photos
+                    break
+            
+            if last_page_reached:
+                break
+            if len(days_seen) >= count * DAY_OVERSAMPLE and len(all_photos) >= count * CANDIDATE_OVERSAMPLE:
+                break
         
-        return R * c
+        return all_photos
     
     async def get_random_photos_with_gps(
         self, 
@@ -50,217 +309,155 @@ class ImmichClient:
         Returns:
             List of photo dictionaries with GPS data
         """
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                # Collect all photos with GPS from multiple pages
-                all_photos = []
-                max_pages = 20  # Scan up to 20 pages
-                
-                for page in range(1, max_pages + 1):
-                    search_params = {
-                        "isNotInAlbum": False,
-                        "withExif": True,
-                        "size": 100,
-                        "page": page
-                    }
-                    
-                    # Add date filters if provided
-                    if start_date:
-                        search_params["takenAfter"] = start_date.isoformat() + "T00:00:00.000Z"
-                    if end_date:
-                        search_params["takenBefore"] = end_date.isoformat() + "T23:59:59.999Z"
-                    
-                    response = await client.post(
-                        f"{self.api_url}/search/metadata",
-                        headers=self.headers,
-                        json=search_params
-                    )
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    # Get assets from response
-                    assets = result.get("assets", {}).get("items", []) if isinstance(result.get("assets"), dict) else result.get("assets", [])
-                    
-                    if not assets:
-                        break  # No more photos
-                    
-                    # Filter assets that have GPS coordinates
-                    for asset in assets:
-                        exif_info = asset.get("exifInfo", {})
-                        if exif_info:
-                            lat = exif_info.get("latitude")
-                            lon = exif_info.get("longitude")
-                            date_taken_str = exif_info.get("dateTimeOriginal")
-                            
-                            # Check if coordinates exist and are not None/0
-                            if lat and lon and lat != 0 and lon != 0 and date_taken_str:
-                                asset_id = asset.get("id")
-                                all_photos.append({
-                                    "id": asset_id,
-                                    "thumbnailUrl": f"/game/photo/{asset_id}/preview",
-                                    "originalUrl": f"{self.api_url}/assets/{asset_id}/original",
-                                    "immichUrl": f"{self.api_url.replace('/api', '')}/photos/{asset_id}",
-                                    "latitude": lat,
-                                    "longitude": lon,
-                                    "city": exif_info.get("city"),
-                                    "state": exif_info.get("state"),
-                                    "country": exif_info.get("country"),
-                                    "dateTaken": date_taken_str,
-                                })
-                
-                if len(all_photos) < count:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail=f"Not enough photos with GPS coordinates found. Found {len(all_photos)}, need {count}. Make sure your photos have GPS metadata in Immich and EXIF extraction is enabled."
-                    )
+        try:
+            all_photos = await self._get_candidates(count, start_date, end_date)
+            
+            if len(all_photos) < count:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Not enough photos with GPS coordinates found. Found {len(all_photos)}, need {count}. Make sure your photos have GPS metadata in Immich and EXIF extraction is enabled."
+                )
+            
+            # Group photos by day
+            photos_by_day = {}
+            for photo in all_photos:
+                # ISO timestamps start with YYYY-MM-DD, which is all we need
+                date_taken_str = photo.date_taken
+                day_key = date_taken_str[:10] if isinstance(date_taken_str, str) and len(date_taken_str) >= 10 else None
+                if day_key is None:
+                    continue
                 
-                # Group photos by day
-                photos_by_day = {}
-                for photo in all_photos:
-                    try:
-                        # Parse date and extract just the day
-                        date_obj = datetime.fromisoformat(photo["dateTaken"].replace("Z", "+00:00"))
-                        day_key = date_obj.date().isoformat()
-                        
-                        if day_key not in photos_by_day:
-                            photos_by_day[day_key] = []
-                        photos_by_day[day_key].append(photo)
-                    except (ValueError, AttributeError):
-                        continue
+                if day_key not in photos_by_day:
+                    photos_by_day[day_key] = []
+                photos_by_day[day_key].append(photo)
+            
+            if len(photos_by_day) < count:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Not enough different days with photos. Found {len(photos_by_day)} days, need {count}. Try widening your date range."
+                )
+            
+            # Select photos from different days with minimum 1km distance
+            selected_photos = []
+            # Locations of already selected photos, kept in sync with selected_photos
+            selected_index = ProximityIndex(MIN_PHOTO_DISTANCE_KM)
+            available_days = list(photos_by_day.keys())
+            random.shuffle(available_days)
+            
+            max_attempts = len(available_days) * 10  # Prevent infinite loop
+            attempts = 0
+            
+            for day in available_days:
+                if len(selected_photos) >= count:
+                    break
                 
-                if len(photos_by_day) < count:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail=f"Not enough different days with photos. Found {len(photos_by_day)} days, need {count}. Try widening your date range."
-                    )
+                attempts += 1
+                if attempts > max_attempts:
+                    break
                 
-                # Select photos from different days with minimum 1km distance
-                selected_photos = []
-                available_days = list(photos_by_day.keys())
-                random.shuffle(available_days)
+                # Shuffle photos from this day
+                day_photos = photos_by_day[day]
+                random.shuffle(day_photos)
                 
-                max_attempts = len(available_days) * 10  # Prevent infinite loop
-                attempts = 0
+                # Convert the whole day batch to radians once
+                day_lat_rad = np.radians([p.latitude for p in day_photos])
+                day_lon_rad = np.radians([p.longitude for p in day_photos])
                 
-                for day in available_days:
+                # Try to find a photo that is at least 1km away from all selected photos
+                for photo, cand_lat_rad, cand_lon_rad in zip(day_photos, day_lat_rad, day_lon_rad):
                     if len(selected_photos) >= count:
                         break
                     
-                    attempts += 1
-                    if attempts > max_attempts:
-                        break
-                    
-                    # Shuffle photos from this day
-                    day_photos = photos_by_day[day]
-                    random.shuffle(day_photos)
+                    # Check distance from all already selected photos
+                    too_close = selected_index.is_near(cand_lat_rad, cand_lon_rad)
                     
-                    # Try to find a photo that is at least 1km away from all selected photos
-                    for photo in day_photos:
-                        if len(selected_photos) >= count:
-                            break
-                        
-                        # Check distance from all already selected photos
-                        too_close = False
-                        for selected in selected_photos:
-                            distance = self._calculate_distance(
-                                photo["latitude"], photo["longitude"],
-                                selected["latitude"], selected["longitude"]
-                            )
-                            if distance < 1.0:  # Less than 1km
-                                too_close = True
-                                break
-                        
-                        if not too_close:
-                            selected_photos.append(photo)
-                            break
-                
-                if len(selected_photos) < count:
-                    raise HTTPException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        detail=f"Could not find {count} photos from different days that are at least 1km apart. Found {len(selected_photos)}. Try widening your date range or check your photo library."
-                    )
-                
-                return selected_photos
-                
-            except httpx.HTTPStatusError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"Error connecting to Immich: {str(e)}"
-                )
-            except httpx.RequestError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"Cannot reach Immich server: {str(e)}"
-                )
-    
-    async def get_asset_thumbnail(self, asset_id: str) -> bytes:
-        """
-        Get thumbnail image for an asset.
-        
-        Args:
-            asset_id: The asset ID
+                    if not too_close:
+                        selected_photos.append(photo)
+                        selected_index.add(cand_lat_rad, cand_lon_rad)
+                        break
             
-        Returns:
-            Image bytes
-        """
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.get(
-                    f"{self.api_url}/assets/{asset_id}/thumbnail",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.content
-            except httpx.HTTPError as e:
+            if len(selected_photos) < count:
                 raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"Error fetching thumbnail: {str(e)}"
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Could not find {count} photos from different days that are at least 1km apart. Found {len(selected_photos)}. Try widening your date range or check your photo library."
                 )
+            
+            return [self._photo_from_candidate(photo) for photo in selected_photos]
+            
+        except HTTPException as e:
+            # A pool no game could be picked from would fail every retry until it expires;
+            # drop it so the next attempt draws a new sample
+            if e.status_code == status.HTTP_404_NOT_FOUND:
+                self._candidate_pools.pop((start_date, end_date), None)
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.warning("Immich search failed", exc_info=e)
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"Error connecting to Immich: Immich returned {e.response.status_code}"
+            )
+        except httpx.RequestError as e:
+            logger.warning("Immich search failed", exc_info=e)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Cannot reach Immich server"
+            )
     
-    async def get_asset_preview(self, asset_id: str) -> bytes:
+    async def open_asset_stream(self, asset_id: str, quality: str) -> httpx.Response:
         """
-        Get preview (high quality) image for an asset.
+        Open a streaming download of an asset image.
         
         Args:
             asset_id: The asset ID
+            quality: "thumbnail", "preview" or "original"
             
         Returns:
-            Image bytes
+            Response with an unread body; the caller must close it with aclose()
         """
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                response = await client.get(
-                    f"{self.api_url}/assets/{asset_id}/thumbnail?size=preview",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.content
-            except httpx.HTTPError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"Error fetching preview image: {str(e)}"
-                )
+        path, params, label = ASSET_QUALITIES.get(quality, ASSET_QUALITIES["thumbnail"])
+        request = self._client.build_request(
+            "GET",
+            f"/assets/{asset_id}/{path}",
+            params=params,
+            timeout=60.0
+        )
+        try:
+            response = await self._client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"Error fetching {label}: {str(e)}"
+            )
+        
+        if response.is_error:
+            await response.aclose()
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"Error fetching {label}: Immich returned {response.status_code}"
+            )
+        
+        return response
     
-    async def get_asset_original(self, asset_id: str) -> bytes:
+    async def get_asset(self, asset_id: str, quality: str) -> Tuple[bytes, str]:
         """
-        Get original quality image for an asset.
+        Download a complete asset image.
         
         Args:
             asset_id: The asset ID
+            quality: "thumbnail", "preview" or "original"
             
         Returns:
-            Image bytes
+            Image bytes and their media type
         """
-        async with httpx.AsyncClient(timeout=60.0) as client:
+        async with self._download_slots:
+            response = await self.open_asset_stream(asset_id, quality)
             try:
-                response = await client.get(
-                    f"{self.api_url}/assets/{asset_id}/original",
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                return response.content
+                data = await response.aread()
             except httpx.HTTPError as e:
                 raise HTTPException(
                     status_code=status.HTTP_502_BAD_GATEWAY,
-                    detail=f"Error fetching original image: {str(e)}"
+                    detail=f"Error fetching {quality} image: {str(e)}"
                 )
+            finally:
+                await response.aclose()
+        return data, response.headers.get("content-type", "image/jpeg")
@@ -1,36 +1,93 @@
+from bisect import bisect_right
 from math import radians, sin, cos, sqrt, atan2
 from typing import Tuple
+import numpy as np
+from numba import njit
 
+from .geo import EARTH_RADIUS_KM
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+
+# Upper distance bound (km) of each scoring band below the last one
+SCORE_THRESHOLDS = (0.1, 1, 10, 50, 100, 500, 1000)
+
+# Per band (base, start_km, width_km, drop): score = base - (distance - start) / width * drop.
+# The first band scores max_points, which is filled in per call.
+SCORE_BANDS = (
+    (None, 0, 1, 0),  # < 100m - Perfect!
+    (4000, 0, 1, 0),  # < 1km - Excellent
+    (3000, 1, 9, 1000),  # < 10km - Very good
+    (2000, 10, 40, 1000),  # < 50km - Good
+    (1000, 50, 50, 500),  # < 100km - Okay
+    (500, 100, 400, 400),  # < 500km - Not great
+    (100, 500, 500, 50),  # < 1000km - Poor
+    (50, 0, 10000, 50),  # > 1000km - Very poor, reaching 0 at 10000km
+)
+
+# Band parameters as arrays for calculate_score_batch
+_BAND_BASE = np.array([0.0] + [band[0] for band in SCORE_BANDS[1:]])
+_BAND_START = np.array([band[1] for band in SCORE_BANDS], dtype=np.float64)
+_BAND_WIDTH = np.array([band[2] for band in SCORE_BANDS], dtype=np.float64)
+_BAND_DROP = np.array([band[3] for band in SCORE_BANDS], dtype=np.float64)
+
+# A target location converted once for repeated scoring: (lat_rad, lon_rad, cos(lat_rad))
+Target = Tuple[float, float, float]
+
+
+@njit(cache=True, fastmath=True)
+def precompute_target(lat: float, lon: float) -> Target:
     """
-    Calculate the great circle distance between two points on Earth.
+    Convert a target location for use with haversine_precomp.
     
     Args:
-        lat1, lon1: Coordinates of the first point (degrees)
-        lat2, lon2: Coordinates of the second point (degrees)
+        lat, lon: Coordinates of the target (degrees)
         
     Returns:
-        Distance in kilometers
+        Latitude and longitude in radians, and the cosine of the latitude
+    """
+    lat_rad = radians(lat)
+    return lat_rad, radians(lon), cos(lat_rad)
+
+
+@njit(cache=True, fastmath=True)
+def haversine_precomp(lat: float, lon: float, target: Target) -> float:
     """
-    # Earth's radius in kilometers
-    R = 6371.0
+    Calculate the great circle distance from a point to a precomputed target.
     
-    # Convert coordinates to radians
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
+    Scoring many guesses against the same photo only converts the photo once.
+    
+    Args:
+        lat, lon: Coordinates of the point (degrees)
+        target: Target from precompute_target
+        
+    Returns:
+        Distance in kilometers
+    """
+    target_lat_rad, target_lon_rad, target_cos_lat = target
+    lat_rad = radians(lat)
     
     # Haversine formula
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+    dlat = target_lat_rad - lat_rad
+    dlon = target_lon_rad - radians(lon)
     
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
+    a = sin(dlat / 2)**2 + cos(lat_rad) * target_cos_lat * sin(dlon / 2)**2
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
     
-    distance = R * c
-    return distance
+    return EARTH_RADIUS_KM * c
+
+
+@njit(cache=True, fastmath=True)
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calculate the great circle distance between two points on Earth.
+    
+    Args:
+        lat1, lon1: Coordinates of the first point (degrees)
+        lat2, lon2: Coordinates of the second point (degrees)
+        
+    Returns:
+        Distance in kilometers
+    """
+    return haversine_precomp(lat1, lon1, precompute_target(lat2, lon2))
 
 
 def calculate_score(distance_km: float, max_points: int = 5000) -> int:
@@ -54,24 +111,60 @@ def calculate_score(distance_km: float, max_points: int = 5000) -> int:
     Returns:
         Score (0 to max_points)
     """
-    if distance_km < 0.1:  # < 100m - Perfect!
+    band = bisect_right(SCORE_THRESHOLDS, distance_km)
+    if band == 0:
         return max_points
-    elif distance_km < 1:  # < 1km - Excellent
-        return 4000
-    elif distance_km < 10:  # < 10km - Very good
-        ratio = (distance_km - 1) / 9
-        return int(3000 - ratio * 1000)
-    elif distance_km < 50:  # < 50km - Good
-        ratio = (distance_km - 10) / 40
-        return int(2000 - ratio * 1000)
-    elif distance_km < 100:  # < 100km - Okay
-        ratio = (distance_km - 50) / 50
-        return int(1000 - ratio * 500)
-    elif distance_km < 500:  # < 500km - Not great
-        ratio = (distance_km - 100) / 400
-        return int(500 - ratio * 400)
-    elif distance_km < 1000:  # < 1000km - Poor
-        ratio = (distance_km - 500) / 500
-        return int(100 - ratio * 50)
-    else:  # > 1000km - Very poor
-        return max(0, int(50 * (1 - min(distance_km / 10000, 1))))
+    base, start, width, drop = SCORE_BANDS[band]
+    return max(0, int(base - (distance_km - start) / width * drop))
+
+
+def haversine_batch(lat1: float, lon1: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Calculate the great circle distances from one point to many points at once.
+    
+    Args:
+        lat1, lon1: Coordinates of the point (degrees)
+        lats, lons: Coordinates of the other points (degrees)
+        
+    Returns:
+        Distances in kilometers, one per point
+    """
+    return _haversine_batch(
+        float(lat1), float(lon1),
+        np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    )
+
+
+@njit(cache=True, fastmath=True)
+def _haversine_batch(lat1: float, lon1: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Compiled loop behind haversine_batch."""
+    target = precompute_target(lat1, lon1)
+    distances = np.empty(lats.shape[0])
+    for i in range(lats.shape[0]):
+        distances[i] = haversine_precomp(lats[i], lons[i], target)
+    return distances
+
+
+def calculate_score_batch(distances_km: np.ndarray, max_points: int = 5000) -> np.ndarray:
+    """
+    Calculate scores for many distances at once, using the same scale as calculate_score.
+    
+    Args:
+        distances_km: Distances in kilometers
+        max_points: Maximum possible points
+        
+    Returns:
+        Scores (0 to max_points), one per distance
+    """
+    d = np.asarray(distances_km, dtype=np.float64)
+    band = np.searchsorted(SCORE_THRESHOLDS, d, side="right")
+    base = np.where(band == 0, max_points, _BAND_BASE[band])
+    scores = base - (d - _BAND_START[band]) / _BAND_WIDTH[band] * _BAND_DROP[band]
+    # Truncate like int() in calculate_score
+    return np.maximum(scores.astype(np.int64), 0)
+
+
+def warmup():
+    """Compile the JIT kernels so the first guess does not pay for it."""
+    haversine_distance(0.0, 0.0, 0.0, 0.0)
+    haversine_batch(0.0, 0.0, np.zeros(1), np.zeros(1))
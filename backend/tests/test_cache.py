@@ -0,0 +1,201 @@
+import asyncio
+import gc
+
+import pytest
+from redis.asyncio import Redis
+
+from app.services import cache as cache_module
+from app.services.cache import AssetCache, CachedAsset
+
+
+@pytest.fixture(autouse=True)
+def short_inflight_wait(monkeypatch):
+    """Make a claim that is never released fail a test in seconds instead of stalling it."""
+    monkeypatch.setattr(cache_module, "INFLIGHT_WAIT_TIMEOUT", 2.0)
+
+
+class StubRedis:
+    """In-memory stand-in for the few Redis hash commands AssetCache uses."""
+    
+    def __init__(self):
+        self.hashes = {}
+    
+    async def hmget(self, key, *fields):
+        stored = self.hashes.get(key, {})
+        return [stored.get(field) for field in fields]
+    
+    def pipeline(self, transaction=True):
+        return StubPipeline(self)
+
+
+class StubPipeline:
+    def __init__(self, redis: StubRedis):
+        self.redis = redis
+        self.commands = []
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        pass
+    
+    def hset(self, key, mapping):
+        self.commands.append((key, mapping))
+    
+    def expire(self, key, ttl):
+        pass
+    
+    async def execute(self):
+        for key, mapping in self.commands:
+            self.redis.hashes[key] = {
+                field: value.encode() if isinstance(value, str) else value
+                for field, value in mapping.items()
+            }
+
+
+def make_download(calls: list, data: bytes = b"image", fail: bool = False):
+    """Download callable for AssetCache.fetch that records its calls."""
+    async def download():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if fail:
+            raise RuntimeError("Immich unavailable")
+        return data, "image/webp"
+    return download
+
+
+async def chunks_of(data: bytes, started: asyncio.Event = None, release: asyncio.Event = None):
+    """Image body that yields one byte at a time, optionally pausing after the first chunk."""
+    for i, byte in enumerate(data):
+        yield bytes([byte])
+        if i == 0 and started is not None:
+            started.set()
+            await release.wait()
+
+
+def test_concurrent_fetches_download_once():
+    async def run():
+        cache = AssetCache(StubRedis())
+        calls = []
+        results = await asyncio.gather(*(
+            cache.fetch("a1", "preview", make_download(calls)) for _ in range(5)
+        ))
+        return cache, calls, results
+    
+    cache, calls, results = asyncio.run(run())
+    
+    assert len(calls) == 1
+    assert results == [CachedAsset(b"image", "image/webp")] * 5
+    assert cache._inflight == {}
+
+
+def test_failed_download_hands_none_to_waiters_and_releases_claim():
+    async def run():
+        cache = AssetCache(StubRedis())
+        calls = []
+        first = asyncio.ensure_future(cache.fetch("a1", "preview", make_download(calls, fail=True)))
+        await asyncio.sleep(0)
+        waiter = await cache.get("a1", "preview")
+        first_error = None
+        try:
+            await first
+        except RuntimeError as e:
+            first_error = e
+        
+        # The claim is gone, so the next request downloads again
+        retried = await cache.fetch("a1", "preview", make_download(calls))
+        return waiter, first_error, retried, calls
+    
+    waiter, first_error, retried, calls = asyncio.run(run())
+    
+    assert waiter is None
+    assert first_error is not None
+    assert retried == CachedAsset(b"image", "image/webp")
+    assert len(calls) == 2
+
+
+def test_waiter_gives_up_on_abandoned_claim(monkeypatch):
+    monkeypatch.setattr(cache_module, "INFLIGHT_WAIT_TIMEOUT", 0.05)
+    
+    async def run():
+        cache = AssetCache(StubRedis())
+        # A download that claimed the key and never finished
+        cache._claim(cache._key("a1", "preview"))
+        result = await cache.get("a1", "preview")
+        return cache, result
+    
+    cache, result = asyncio.run(run())
+    
+    assert result is None
+    # The stale claim is cleared so the next request fetches the image itself
+    assert cache._inflight == {}
+
+
+def test_tee_claims_on_first_chunk_and_shares_the_image():
+    async def run():
+        cache = AssetCache(StubRedis())
+        started, release = asyncio.Event(), asyncio.Event()
+        body = cache.tee("a1", "preview", "image/webp", chunks_of(b"image", started, release))
+        claimed_before_streaming = bool(cache._inflight)
+        
+        async def stream():
+            return b"".join([chunk async for chunk in body])
+        
+        streaming = asyncio.ensure_future(stream())
+        await started.wait()
+        claimed_while_streaming = bool(cache._inflight)
+        
+        waiter = asyncio.ensure_future(cache.get("a1", "preview"))
+        await asyncio.sleep(0)
+        release.set()
+        return claimed_before_streaming, claimed_while_streaming, await streaming, await waiter, cache
+    
+    before, during, streamed, waited, cache = asyncio.run(run())
+    
+    assert not before
+    assert during
+    assert streamed == b"image"
+    assert waited == CachedAsset(b"image", "image/webp")
+    assert cache._inflight == {}
+
+
+def test_abandoned_tee_releases_claim_when_collected():
+    async def run():
+        cache = AssetCache(StubRedis())
+        started, release = asyncio.Event(), asyncio.Event()
+        body = cache.tee("a1", "preview", "image/webp", chunks_of(b"image", started, release))
+        
+        # Read the first chunk, then drop the stream as a disconnected client would
+        await body.__anext__()
+        waiter = asyncio.ensure_future(cache.get("a1", "preview"))
+        await asyncio.sleep(0)
+        del body
+        gc.collect()
+        result = await asyncio.wait_for(waiter, 1)
+        return cache, result
+    
+    cache, result = asyncio.run(run())
+    
+    assert result is None
+    assert cache._inflight == {}
+
+
+def test_works_without_redis():
+    async def run():
+        cache = AssetCache(Redis.from_url("redis://127.0.0.1:1", socket_connect_timeout=0.2))
+        calls = []
+        results = await asyncio.gather(*(
+            cache.fetch("a1", "thumbnail", make_download(calls)) for _ in range(3)
+        ))
+        # Served from the in-process cache even though Redis is down
+        cached = await cache.get("a1", "thumbnail")
+        missing = await cache.get("a2", "thumbnail")
+        await cache.redis.aclose()
+        return calls, results, cached, missing
+    
+    calls, results, cached, missing = asyncio.run(run())
+    
+    assert len(calls) == 1
+    assert results == [CachedAsset(b"image", "image/webp")] * 3
+    assert cached == CachedAsset(b"image", "image/webp")
+    assert missing is None
@@ -0,0 +1,119 @@
+import asyncio
+import random
+from collections import Counter
+from datetime import date
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from orjson import loads as json_loads
+
+from app.services.immich import ImmichClient
+
+
+# Simulated latency of every Immich search request
+SEARCH_LATENCY = 0.2
+
+# GPS-tagged assets spread over many days and locations
+LIBRARY = [
+    {
+        "id": f"asset-{i}",
+        "exifInfo": {
+            "latitude": 40.0 + (i % 50) * 0.1,
+            "longitude": 10.0 + (i // 50) * 0.1,
+            "dateTimeOriginal": f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:00:00.000Z",
+            "city": "City",
+        },
+    }
+    for i in range(1000)
+]
+
+
+class MockImmich:
+    """Mock Immich server answering random searches after SEARCH_LATENCY, recording what it saw."""
+    
+    def __init__(self, library: list = LIBRARY):
+        self.library = library
+        self.requests = []
+        # Requests currently being answered, by date range
+        self.in_flight = Counter()
+        # Most date ranges that had requests being answered at the same time
+        self.peak_ranges = 0
+    
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        params = json_loads(request.content)
+        self.requests.append(params)
+        date_range = (params.get("takenAfter"), params.get("takenBefore"))
+        self.in_flight[date_range] += 1
+        self.peak_ranges = max(self.peak_ranges, len(+self.in_flight))
+        try:
+            await asyncio.sleep(SEARCH_LATENCY)
+        finally:
+            self.in_flight[date_range] -= 1
+        return httpx.Response(200, json=random.sample(self.library, min(100, len(self.library))))
+    
+    def client(self) -> ImmichClient:
+        client = httpx.AsyncClient(base_url="http://immich.test/api", transport=httpx.MockTransport(self.handler))
+        return ImmichClient("http://immich.test/api", "key", client)
+
+
+def test_starts_with_different_date_ranges_scan_concurrently():
+    server = MockImmich()
+    
+    async def run():
+        async with server.client() as immich:
+            return await asyncio.gather(*(
+                immich.get_random_photos_with_gps(5, start_date=date(2020 + i, 1, 1))
+                for i in range(3)
+            ))
+    
+    results = asyncio.run(run())
+    
+    assert [len(photos) for photos in results] == [5, 5, 5]
+    # Serialized scans would only ever have one date range in flight
+    assert server.peak_ranges == 3
+
+
+def test_starts_with_same_date_range_share_one_scan():
+    server = MockImmich()
+    
+    async def run():
+        async with server.client() as immich:
+            await immich.get_random_photos_with_gps(5)
+            single_scan = len(server.requests)
+            
+            # Drop the cached pool, then start several games at once
+            immich._candidate_pools.clear()
+            server.requests.clear()
+            results = await asyncio.gather(*(immich.get_random_photos_with_gps(5) for _ in range(3)))
+        return single_scan, results
+    
+    single_scan, results = asyncio.run(run())
+    
+    assert [len(photos) for photos in results] == [5, 5, 5]
+    assert len(server.requests) == single_scan
+
+
+def test_failed_selection_does_not_keep_pool():
+    # Every photo taken on the same day, so no game can be picked
+    server = MockImmich([
+        {**asset, "exifInfo": {**asset["exifInfo"], "dateTimeOriginal": "2023-01-01T12:00:00.000Z"}}
+        for asset in LIBRARY[:200]
+    ])
+    
+    async def run():
+        scans = []
+        async with server.client() as immich:
+            for _ in range(2):
+                with pytest.raises(HTTPException) as error:
+                    await immich.get_random_photos_with_gps(5)
+                assert error.value.status_code == 404
+                scans.append(len(server.requests))
+                server.requests.clear()
+        return scans
+    
+    scans = asyncio.run(run())
+    
+    # The second attempt scans Immich again instead of reusing the failed pool
+    assert scans[0] > 0
+    assert scans[1] > 0
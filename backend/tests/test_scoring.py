@@ -0,0 +1,57 @@
+import numpy as np
+
+from app.services.scoring import (
+    SCORE_THRESHOLDS, calculate_score, calculate_score_batch,
+    haversine_batch, haversine_distance
+)
+
+
+# Distances exactly on, and just either side of, every band boundary
+BOUNDARIES = np.array([0.0, 10000.0, 20000.0] + [
+    value
+    for threshold in SCORE_THRESHOLDS
+    for value in (np.nextafter(threshold, 0), threshold, np.nextafter(threshold, np.inf))
+])
+
+
+def test_calculate_score_batch_matches_scalar():
+    rng = np.random.default_rng(0)
+    distances = np.concatenate([
+        rng.uniform(0, 20000, 100000),
+        rng.uniform(0, 1200, 100000),
+        BOUNDARIES,
+    ])
+    
+    for max_points in (5000, 4500):
+        expected = np.array([calculate_score(d, max_points) for d in distances])
+        np.testing.assert_array_equal(calculate_score_batch(distances, max_points), expected)
+
+
+def test_calculate_score_batch_accepts_scalars_and_lists():
+    assert calculate_score_batch(5.0) == calculate_score(5.0)
+    assert calculate_score_batch(0.05, 4500) == 4500
+    assert calculate_score_batch([0.05, 5.0]).tolist() == [5000, calculate_score(5.0)]
+
+
+def test_calculate_score_bands():
+    assert calculate_score(0.0) == 5000
+    assert calculate_score(0.5) == 4000
+    assert calculate_score(1.0) == 3000
+    assert calculate_score(10.0) == 2000
+    assert calculate_score(50.0) == 1000
+    assert calculate_score(100.0) == 500
+    assert calculate_score(500.0) == 100
+    assert calculate_score(1000.0) == 45
+    assert calculate_score(20000.0) == 0
+
+
+def test_haversine_batch_matches_scalar():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(-90, 90, 10000)
+    lons = rng.uniform(-180, 180, 10000)
+    
+    expected = np.array([haversine_distance(10.0, 20.0, lat, lon) for lat, lon in zip(lats, lons)])
+    np.testing.assert_allclose(haversine_batch(10.0, 20.0, lats, lons), expected, rtol=1e-9)
+    
+    # Berlin to Paris
+    assert abs(haversine_distance(52.52, 13.405, 48.8566, 2.3522) - 877.46) < 0.01